@@ -12,6 +12,7 @@ dependency generated by the compiler, and report if they don't exist in GN.
 from __future__ import print_function
 
 import argparse
+import collections
 import json
 import os
 import re
@@ -19,23 +20,66 @@ import shutil
 import subprocess
 import sys
 import tempfile
-from multiprocessing import Process, Queue
+from multiprocessing import Pipe, Process
 
 SRC_DIR = os.path.abspath(
     os.path.join(os.path.abspath(os.path.dirname(__file__)), os.path.pardir))
 DEPOT_TOOLS_DIR = os.path.join(SRC_DIR, 'third_party', 'depot_tools')
 
-
-def GetHeadersFromNinja(out_dir, skip_obj, q):
+# intern() lives in sys on Python 3 and is a builtin on Python 2.
+try:
+  INTERN = sys.intern
+except AttributeError:
+  INTERN = intern
+
+
+def NinjaPathToStr(path):
+  """Converts a path from ninja's bytes output to the native str type."""
+  if str is bytes:  # Python 2.
+    return path
+  return path.decode('utf-8', 'replace')
+
+
+# Matches the first line of each record in "ninja -t deps" output, e.g.
+# "obj/a.o: #deps 2, deps mtime 123 (VALID)", along with the preceding
+# newline. Starting with a literal lets the regex engine skip ahead quickly.
+NINJA_TARGET_RE = re.compile(br'\n([^ \r\n][^\r\n]*)')
+
+
+def SplitNinjaRecords(stream, chunk_size=1 << 22):
+  """Yield "ninja -t deps" output read from |stream| in large bytes chunks,
+  each holding whole records.
+
+  This hands the (potentially multi-GB) output to the parser while ninja is
+  still writing it. Records are separated by a blank line, so each chunk is
+  cut after the last one read so far, with either LF or CRLF line endings.
+  """
+  pending = bytearray()
+  while True:
+    data = stream.read(chunk_size)
+    if not data:
+      break
+    # Only the newly read data, plus the two bytes before it that may start a
+    # separator, can hold a cut point not already found.
+    start = max(0, len(pending) - 2)
+    pending.extend(data)
+    cut = max(pending.rfind(b'\n\n', start),
+              pending.rfind(b'\n\r\n', start)) + 1
+    if cut:
+      yield bytes(pending[:cut])
+      del pending[:cut]
+  if pending:
+    yield bytes(pending)
+
+
+def GetHeadersFromNinja(out_dir, skip_obj, conn):
   """Return all the header files from ninja_deps"""
 
   def NinjaSource():
     cmd = [os.path.join(DEPOT_TOOLS_DIR, 'ninja'), '-C', out_dir, '-t', 'deps']
-    # A negative bufsize means to use the system default, which usually
-    # means fully buffered.
-    popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=-1)
-    for line in iter(popen.stdout.readline, ''):
-      yield line.rstrip()
+    popen = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    for chunk in SplitNinjaRecords(popen.stdout):
+      yield chunk
 
     popen.stdout.close()
     return_code = popen.wait()
@@ -47,43 +91,64 @@ def GetHeadersFromNinja(out_dir, skip_obj, q):
     ans = ParseNinjaDepsOutput(NinjaSource(), out_dir, skip_obj)
   except Exception as e:
     err = str(e)
-  q.put((ans, err))
+  conn.send((ans, err))
+  conn.close()
 
 
 def ParseNinjaDepsOutput(ninja_out, out_dir, skip_obj):
-  """Parse ninja output and get the header files"""
-  all_headers = {}
+  """Parse ninja output and get the header files
+
+  |ninja_out| is an iterable of bytes chunks, each holding whole records.
+  """
+  # Collect the raw dependency lines of VALID records with C-level split()
+  # and set/list operations. The same headers recur across most records, so
+  # matching, filtering and decoding are left until the end, once per unique
+  # line.
+  raw_deps = set() if skip_obj else collections.defaultdict(list)
+
+  for chunk in ninja_out:
+    # Let NINJA_TARGET_RE match a record starting the chunk too.
+    chunk = b'\n' + chunk
+    targets = [(m.group(1), m.end()) for m in NINJA_TARGET_RE.finditer(chunk)]
+    targets.append((b'', len(chunk)))
+    for i in range(len(targets) - 1):
+      line, start = targets[i]
+      if not line.rstrip().endswith(b'(VALID)'):
+        continue
+      # Take the lines up to the next record's first line.
+      deps = chunk[start:targets[i + 1][1] - len(targets[i + 1][0])].split(
+          b'\n')
+      if skip_obj:
+        raw_deps.update(deps)
+      else:
+        obj_file = INTERN(NinjaPathToStr(line.split(b':', 1)[0]))
+        for dep in deps:
+          raw_deps[dep].append(obj_file)
 
   # Ninja always uses "/", even on Windows.
-  prefix = '../../'
+  prefix = b'    ../../'
+  header_suffixes = (b'.h', b'.hh')
+  # build/ only contains build-specific files like build_config.h
+  # and buildflag.h, and system header files, so they should be
+  # skipped.
+  skipped_prefixes = (out_dir.encode('utf-8'), b'out', b'build')
 
-  is_valid = False
-  obj_file = ''
-  for line in ninja_out:
-    if line.startswith('    '):
-      if not is_valid:
-        continue
-      if line.endswith('.h') or line.endswith('.hh'):
-        f = line.strip()
-        if f.startswith(prefix):
-          f = f[6:]  # Remove the '../../' prefix
-          # build/ only contains build-specific files like build_config.h
-          # and buildflag.h, and system header files, so they should be
-          # skipped.
-          if f.startswith(out_dir) or f.startswith('out'):
-            continue
-          if not f.startswith('build'):
-            all_headers.setdefault(f, [])
-            if not skip_obj:
-              all_headers[f].append(obj_file)
-    else:
-      is_valid = line.endswith('(VALID)')
-      obj_file = line.split(':')[0]
+  all_headers = {}
+  for dep in raw_deps:
+    f = dep.rstrip(b'\r')
+    if not f.startswith(prefix) or not f.endswith(header_suffixes):
+      continue
+    f = f[len(prefix):]  # Remove the indent and the '../../' prefix.
+    if f.startswith(skipped_prefixes):
+      continue
+    headers = all_headers.setdefault(NinjaPathToStr(f), [])
+    if not skip_obj:
+      headers.extend(raw_deps[dep])
 
   return all_headers
 
 
-def GetHeadersFromGN(out_dir, q):
+def GetHeadersFromGN(out_dir, conn):
   """Return all the header files from GN"""
 
   tmp = None
@@ -98,38 +163,50 @@ def GetHeadersFromGN(out_dir, q):
     gn_exe = 'gn.bat' if sys.platform == 'win32' else 'gn'
     subprocess.check_call([
         os.path.join(DEPOT_TOOLS_DIR, gn_exe), 'gen', tmp, '--ide=json', '-q'])
-    gn_json = json.load(open(os.path.join(tmp, 'project.json')))
+    with open(os.path.join(tmp, 'project.json')) as f:
+      gn_json = json.load(f, object_pairs_hook=TrimGNProjectJSON)
     ans = ParseGNProjectJSON(gn_json, out_dir, tmp)
   except Exception as e:
     err = str(e)
   finally:
     if tmp:
       shutil.rmtree(tmp)
-  q.put((ans, err))
+  conn.send((ans, err))
+  conn.close()
+
+
+def TrimGNProjectJSON(pairs):
+  """object_pairs_hook for json.load() that drops everything in GN's
+  project.json except what ParseGNProjectJSON reads, as it is decoded."""
+  # Target labels, the only keys of gn['targets'], all start with '//'.
+  return {k: v for k, v in pairs
+          if k in ('targets', 'sources', 'public') or k.startswith('//')}
 
 
 def ParseGNProjectJSON(gn, out_dir, tmp_out):
   """Parse GN output and get the header files"""
   all_headers = set()
 
-  for _target, properties in gn['targets'].iteritems():
+  def Canonicalize(f):
+    f = f[2:]  # Strip the '//' prefix.
+    if f.startswith(tmp_out):
+      f = out_dir + f[len(tmp_out):]
+    return f
+
+  for _target, properties in gn['targets'].items():
     sources = properties.get('sources', [])
     public = properties.get('public', [])
     # Exclude '"public": "*"'.
     if type(public) is list:
-      sources += public
-    for f in sources:
-      if f.endswith('.h') or f.endswith('.hh'):
-        if f.startswith('//'):
-          f = f[2:]  # Strip the '//' prefix.
-          if f.startswith(tmp_out):
-            f = out_dir + f[len(tmp_out):]
-          all_headers.add(f)
+      sources = sources + public
+    all_headers.update(
+        Canonicalize(f) for f in sources
+        if f.endswith(('.h', '.hh')) and f.startswith('//'))
 
   return all_headers
 
 
-def GetDepsPrefixes(q):
+def GetDepsPrefixes(conn):
   """Return all the folders controlled by DEPS file"""
   prefixes, err = set(), None
   try:
@@ -145,7 +222,8 @@ def GetDepsPrefixes(q):
         prefixes.add(i)
   except Exception as e:
     err = str(e)
-  q.put((prefixes, err))
+  conn.send((prefixes, err))
+  conn.close()
 
 
 def IsBuildClean(out_dir):
@@ -160,21 +238,37 @@ def IsBuildClean(out_dir):
 def ParseWhiteList(whitelist):
   out = set()
   for line in whitelist.split('\n'):
-    line = re.sub(r'#.*', '', line).strip()
+    line = line.partition('#')[0].strip()  # Drop any trailing comment.
     if line:
       out.add(line)
   return out
 
 
 def FilterOutDepsedRepo(files, deps):
-  return {f for f in files if not any(f.startswith(d) for d in deps)}
+  # Check all the prefixes in a single C-level startswith() call per file.
+  deps = tuple(deps)
+  return {f for f in files if not f.startswith(deps)}
 
 
 def GetNonExistingFiles(lst):
-  out = set()
+  # List each directory once instead of stat()ing every file in it. Names not
+  # listed, e.g. because of case-insensitive file systems or because there is
+  # no os.scandir on Python 2, are still checked with os.path.isfile.
+  scandir = getattr(os, 'scandir', None)
+  by_dir = collections.defaultdict(list)
   for f in lst:
-    if not os.path.isfile(f):
-      out.add(f)
+    by_dir[os.path.dirname(f)].append(f)
+
+  out = set()
+  for d, files in by_dir.items():
+    present = frozenset()
+    if scandir:
+      try:
+        present = {e.name for e in scandir(d or '.') if e.is_file()}
+      except OSError:
+        pass
+    out.update(f for f in files
+               if os.path.basename(f) not in present and not os.path.isfile(f))
   return out
 
 
@@ -220,31 +314,42 @@ def main():
       # Assume running interactively.
       parser.error(dirty_msg)
 
-  d_q = Queue()
-  d_p = Process(target=GetHeadersFromNinja, args=(args.out_dir, True, d_q,))
+  # Each worker produces exactly one result, so hand it back over a one-way
+  # pipe. The parent's copy of the write end is closed right away so that
+  # recv() raises EOFError instead of hanging if a worker dies early.
+
+  # The detailed obj dependency info is slower to collect, so only gather it
+  # when it will be printed. One ninja pass serves both cases.
+  d_r, d_w = Pipe(duplex=False)
+  d_p = Process(target=GetHeadersFromNinja,
+                args=(args.out_dir, not args.verbose, d_w,))
   d_p.start()
+  d_w.close()
 
-  gn_q = Queue()
-  gn_p = Process(target=GetHeadersFromGN, args=(args.out_dir, gn_q,))
+  gn_r, gn_w = Pipe(duplex=False)
+  gn_p = Process(target=GetHeadersFromGN, args=(args.out_dir, gn_w,))
   gn_p.start()
+  gn_w.close()
 
-  deps_q = Queue()
-  deps_p = Process(target=GetDepsPrefixes, args=(deps_q,))
+  deps_r, deps_w = Pipe(duplex=False)
+  deps_p = Process(target=GetDepsPrefixes, args=(deps_w,))
   deps_p.start()
+  deps_w.close()
 
-  d, d_err = d_q.get()
-  gn, gn_err = gn_q.get()
+  # Receive before joining: a worker blocks in send() until its result has
+  # been read.
+  d, d_err = d_r.recv()
+  d_p.join()
+  gn, gn_err = gn_r.recv()
+  gn_p.join()
   missing = set(d.keys()) - gn
   nonexisting = GetNonExistingFiles(gn)
 
-  deps, deps_err = deps_q.get()
+  deps, deps_err = deps_r.recv()
+  deps_p.join()
   missing = FilterOutDepsedRepo(missing, deps)
   nonexisting = FilterOutDepsedRepo(nonexisting, deps)
 
-  d_p.join()
-  gn_p.join()
-  deps_p.join()
-
   if d_err:
     PrintError(d_err)
   if gn_err:
@@ -284,9 +389,6 @@ def main():
       print(i)
 
   if args.verbose:
-    # Only get detailed obj dependency here since it is slower.
-    GetHeadersFromNinja(args.out_dir, False, d_q)
-    d, d_err = d_q.get()
     print('\nDetailed dependency info:')
     for f in missing:
       print(f)
@@ -294,10 +396,10 @@ def main():
         print('  ', cc)
 
     print('\nMissing headers sorted by number of affected object files:')
-    count = {k: len(v) for (k, v) in d.iteritems()}
-    for f in sorted(count, key=count.get, reverse=True):
-      if f in missing:
-        print(count[f], f)
+    # Only the missing headers are printed, so only sort those. Ties keep
+    # the alphabetical order of |missing|.
+    for f in sorted(missing, key=lambda f: len(d[f]), reverse=True):
+      print(len(d[f]), f)
 
   if args.json:
     # Assume running on the bots. Temporarily return 0 before
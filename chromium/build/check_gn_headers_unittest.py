@@ -3,8 +3,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import io
 import logging
 import json
+import os
+import shutil
+import tempfile
 import unittest
 import check_gn_headers
 
@@ -30,7 +34,7 @@ obj/c.o: #deps 1, deps mtime 123 (VALID)
 '''
 
 
-gn_input = json.loads(r'''
+gn_json = r'''
 {
    "others": [],
    "targets": {
@@ -48,7 +52,8 @@ gn_input = json.loads(r'''
       }
     }
 }
-''')
+'''
+gn_input = json.loads(gn_json)
 
 
 whitelist = r'''
@@ -64,7 +69,7 @@ a/b/c
 class CheckGnHeadersTest(unittest.TestCase):
   def testNinja(self):
     headers = check_gn_headers.ParseNinjaDepsOutput(
-        ninja_input.split('\n'), 'out/Release', False)
+        [ninja_input.encode('utf-8')], 'out/Release', False)
     expected = {
         'dir/path/b.h': ['obj/a.o'],
         'c.hh': ['obj/a.o'],
@@ -73,6 +78,28 @@ class CheckGnHeadersTest(unittest.TestCase):
     }
     self.assertEquals(headers, expected)
 
+  def testNinjaChunks(self):
+    chunks = [r.encode('utf-8') + b'\n' for r in ninja_input.split('\n\n')]
+    headers = check_gn_headers.ParseNinjaDepsOutput(chunks, 'out/Release', True)
+    expected = {
+        'dir/path/b.h': [],
+        'c.hh': [],
+        'dir3/path/b.h': [],
+        'c3.hh': [],
+    }
+    self.assertEquals(headers, expected)
+
+  def testNinjaSplitRecords(self):
+    for newline in ['\n', '\r\n']:
+      data = (ninja_input * 3).replace('\n', newline).encode('utf-8')
+      chunks = list(check_gn_headers.SplitNinjaRecords(io.BytesIO(data), 16))
+      self.assertEquals(b''.join(chunks), data)
+      # Every record boundary in the input is a chance to cut.
+      self.assertGreater(len(chunks), 3)
+      self.assertEquals(
+          check_gn_headers.ParseNinjaDepsOutput(chunks, 'out/Release', False),
+          check_gn_headers.ParseNinjaDepsOutput([data], 'out/Release', False))
+
   def testGn(self):
     headers = check_gn_headers.ParseGNProjectJSON(gn_input,
                                                   'out/Release', 'tmp')
@@ -85,6 +112,17 @@ class CheckGnHeadersTest(unittest.TestCase):
     ])
     self.assertEquals(headers, expected)
 
+  def testGnTrimmed(self):
+    gn = json.loads(gn_json,
+                    object_pairs_hook=check_gn_headers.TrimGNProjectJSON)
+    self.assertEquals(gn['targets']['//:base'], {
+        'public': ['//base/p.h'],
+        'sources': ['//base/a.cc', '//base/a.h', '//base/b.hh'],
+    })
+    self.assertEquals(
+        check_gn_headers.ParseGNProjectJSON(gn, 'out/Release', 'tmp'),
+        check_gn_headers.ParseGNProjectJSON(gn_input, 'out/Release', 'tmp'))
+
   def testWhitelist(self):
     output = check_gn_headers.ParseWhiteList(whitelist)
     expected = set([
@@ -95,6 +133,30 @@ class CheckGnHeadersTest(unittest.TestCase):
     ])
     self.assertEquals(output, expected)
 
+  def testFilterOutDepsedRepo(self):
+    files = set(['base/a.h', 'third_party/x/b.h', 'v8/include/c.h'])
+    self.assertEquals(
+        check_gn_headers.FilterOutDepsedRepo(files, set(['third_party/x/',
+                                                         'v8/'])),
+        set(['base/a.h']))
+    self.assertEquals(check_gn_headers.FilterOutDepsedRepo(files, set()),
+                      files)
+
+  def testNonExistingFiles(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      os.mkdir(os.path.join(tmp, 'dir'))
+      open(os.path.join(tmp, 'dir', 'a.h'), 'w').close()
+      present = os.path.join(tmp, 'dir', 'a.h')
+      missing = os.path.join(tmp, 'dir', 'b.h')
+      missing_dir = os.path.join(tmp, 'nodir', 'c.h')
+      self.assertEquals(
+          check_gn_headers.GetNonExistingFiles(
+              [present, missing, missing_dir]),
+          set([missing, missing_dir]))
+    finally:
+      shutil.rmtree(tmp)
+
 
 if __name__ == '__main__':
   logging.getLogger().setLevel(logging.DEBUG)
@@ -10,9 +10,12 @@ from __future__ import print_function
 import argparse
 import collections
 import copy
+import functools
 import json
 import logging
 import math
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import shutil
@@ -181,13 +184,18 @@ def WriteGerritPluginSizeData(output_path, package_sizes):
     json.dump(sizes_data, sizes_file)
 
 
-def GetCompressedSize(file_path):
-  """Measures file size after blobfs compression."""
+def GetCompressedSize(file_path, compressed_dir):
+  """Measures file size after blobfs compression.
+
+  The compressed file is written to |compressed_dir|, which is shared by all
+  calls, and removed once measured."""
 
   compressor_path = GetHostToolPathFromPlatform('blobfs-compression')
+  # Prefix the process id so that concurrent workers compressing the same blob
+  # do not clobber each other's output.
+  compressed_file_path = os.path.join(
+      compressed_dir, '%d_%s' % (os.getpid(), os.path.basename(file_path)))
   try:
-    temp_dir = tempfile.mkdtemp()
-    compressed_file_path = os.path.join(temp_dir, os.path.basename(file_path))
     compressor_cmd = [
         compressor_path,
         '--source_file=%s' % file_path,
@@ -195,14 +203,17 @@ def GetCompressedSize(file_path):
     ]
     proc = subprocess.Popen(compressor_cmd,
                             stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    proc.wait()
-    compressor_output = proc.stdout.read()
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    # communicate() drains the pipe while waiting, so a chatty compressor
+    # cannot block on a full pipe.
+    compressor_output, _ = proc.communicate()
     if proc.returncode != 0:
       print(compressor_output, file=sys.stderr)
       raise Exception('Error while running %s' % compressor_path)
   finally:
-    shutil.rmtree(temp_dir)
+    if os.path.exists(compressed_file_path):
+      os.remove(compressed_file_path)
 
   # Match a compressed bytes total from blobfs-compression output like
   # Wrote 360830 bytes (40% compression)
@@ -216,7 +227,8 @@ def GetCompressedSize(file_path):
   # Round the compressed file size up to an integer number of blobfs blocks.
   BLOBFS_BLOCK_SIZE = 8192  # Fuchsia's blobfs file system uses 8KiB blocks.
   blob_bytes = int(match.group('bytes'))
-  return math.ceil(blob_bytes / BLOBFS_BLOCK_SIZE) * BLOBFS_BLOCK_SIZE
+  return ((blob_bytes + BLOBFS_BLOCK_SIZE - 1) //
+          BLOBFS_BLOCK_SIZE) * BLOBFS_BLOCK_SIZE
 
 
 def ExtractFarFile(file_path, extract_dir):
@@ -243,10 +255,17 @@ def GetBlobNameHashes(meta_dir):
 
   blob_name_hashes = {}
   contents_path = os.path.join(meta_dir, 'meta', 'contents')
-  with open(contents_path) as lines:
-    for line in lines:
-      (pkgfs_path, blob_hash) = line.strip().split('=')
-      blob_name_hashes[pkgfs_path] = blob_hash
+  with open(contents_path) as contents_file:
+    lines = contents_file.read().splitlines()
+  # Each line has the form "pkgfs_path=blob_hash".
+  for line in lines:
+    line = line.strip()
+    if not line:
+      continue
+    pkgfs_path, sep, blob_hash = line.partition('=')
+    if not sep:
+      raise Exception('Malformed line "%s" in "%s".' % (line, contents_path))
+    blob_name_hashes[pkgfs_path] = blob_hash
   return blob_name_hashes
 
 
@@ -264,8 +283,11 @@ def CommitPositionFromBuildProperty(value):
   raise RuntimeError('Could not get chromium commit position from test arg.')
 
 
-# Compiled regular expression matching strings like *.so, *.so.1, *.so.2, ...
-SO_FILENAME_REGEXP = re.compile(r'\.so(\.\d+)?$')
+def IsSharedObjectFileName(name):
+  """Returns True for file names like *.so, *.so.1, *.so.2, ..."""
+
+  _, sep, version = name.rpartition('.so.')
+  return name.endswith('.so') or (bool(sep) and version.isdigit())
 
 
 def GetSdkModulesForExclusion():
@@ -278,16 +300,18 @@ def GetSdkModulesForExclusion():
   # Fuchsia SDK arch directory path (contains all shared object files).
   sdk_arch_dir = os.path.join(SDK_ROOT, 'arch')
   # Leaf subdirectories containing shared object files.
-  sdk_so_leaf_dirs = ['dist', 'lib']
-  # Match a shared object file name.
-  sdk_so_filename_re = r'\.so(\.\d+)?$'
+  sdk_so_leaf_dirs = frozenset(['dist', 'lib'])
+  # Subdirectories that only hold headers, such as sysroot/include, and make
+  # up most of the tree. Nothing under them is ever a shared object.
+  sdk_pruned_dirs = frozenset(['include'])
 
   lib_names = set()
-  for dirpath, _, file_names in os.walk(sdk_arch_dir):
+  for dirpath, dir_names, file_names in os.walk(sdk_arch_dir):
+    # Prune in place so that os.walk does not descend into header trees.
+    dir_names[:] = [d for d in dir_names if d not in sdk_pruned_dirs]
     if os.path.basename(dirpath) in sdk_so_leaf_dirs:
-      for name in file_names:
-        if SO_FILENAME_REGEXP.search(name):
-          lib_names.add(name)
+      lib_names.update(name for name in file_names
+                       if IsSharedObjectFileName(name))
   return lib_names
 
 
@@ -297,9 +321,12 @@ def FarBaseName(name):
   return name
 
 
-def GetBlobs(far_file, build_out_dir, extract_dir):
+def GetBlobs(far_file, build_out_dir, extract_dir, compressed_dir, pool,
+             excluded_files):
   """Calculates compressed and uncompressed blob sizes for specified FAR file.
-  Does not count blobs from SDK libraries."""
+  Does not count blobs whose file names are in |excluded_files|. Blobs are
+  compressed in parallel into |compressed_dir| using the multiprocessing
+  |pool|."""
 
   #TODO(crbug.com/1126177): Use partial sizes for blobs shared by packages.
   base_name = FarBaseName(far_file)
@@ -317,18 +344,24 @@ def GetBlobs(far_file, build_out_dir, extract_dir):
   # Map Linux filesystem blob names to blob hashes.
   blob_name_hashes = GetBlobNameHashes(meta_far_extract_dir)
 
-  # File names whose sizes are not charged against component's size budgets.
-  # Fuchsia SDK modules and the ICU icudtl.dat file are excluded from sizes.
-  excluded_files = GetSdkModulesForExclusion() | set(['icudtl.dat'])
-
   # Sum compresses and uncompressed blob sizes, except for SDK blobs.
+  charged_blobs = [(blob_name, blob_hash)
+                   for blob_name, blob_hash in blob_name_hashes.items()
+                   if os.path.basename(blob_name) not in excluded_files]
+  blob_paths = [
+      os.path.join(far_extract_dir, blob_hash)
+      for _, blob_hash in charged_blobs
+  ]
+  # Each compression runs blobfs-compression in a subprocess, so fan them out.
+  compressed_sizes = pool.map(
+      functools.partial(GetCompressedSize, compressed_dir=compressed_dir),
+      blob_paths)
+
   blobs = {}
-  for blob_name, blob_hash in blob_name_hashes.items():
-    if os.path.basename(blob_name) not in excluded_files:
-      extracted_blob_path = os.path.join(far_extract_dir, blob_hash)
-      compressed = GetCompressedSize(extracted_blob_path)
-      uncompressed = os.path.getsize(extracted_blob_path)
-      blobs[blob_name] = Blob(blob_name, blob_hash, compressed, uncompressed)
+  for (blob_name, blob_hash), extracted_blob_path, compressed in zip(
+      charged_blobs, blob_paths, compressed_sizes):
+    uncompressed = os.path.getsize(extracted_blob_path)
+    blobs[blob_name] = Blob(blob_name, blob_hash, compressed, uncompressed)
 
   return blobs
 
@@ -340,13 +373,44 @@ def GetPackageSizes(far_files, build_out_dir, extract_dir):
   #TODO(crbug.com/1126177): Use partial sizes for blobs shared by
   # non Chrome-Fuchsia packages.
 
-  # Get sizes for blobs contained in packages.
-  package_blobs = {}
+  # File names whose sizes are not charged against component's size budgets.
+  # Fuchsia SDK modules and the ICU icudtl.dat file are excluded from sizes.
+  # The SDK is the same for every package, so only scan it once.
+  excluded_files = GetSdkModulesForExclusion() | set(['icudtl.dat'])
+  # Scratch space for compressed blobs, removed along with |extract_dir|.
+  compressed_dir = tempfile.mkdtemp(dir=extract_dir)
+
+  package_names = []
   for far_file in far_files:
     package_name = FarBaseName(far_file)
-    if package_name in package_blobs:
+    if package_name in package_names:
       raise Exception('Duplicate FAR file base name "%s".' % package_name)
-    package_blobs[package_name] = GetBlobs(far_file, build_out_dir, extract_dir)
+    package_names.append(package_name)
+
+  # Get sizes for blobs contained in packages. Extracting FAR files is bound by
+  # the far tool's subprocesses, which release the GIL while waited on, so
+  # overlap packages using threads. All of them share the process pool for
+  # blob compression.
+  pool = multiprocessing.Pool(multiprocessing.cpu_count())
+  thread_pool = multiprocessing.pool.ThreadPool(max(1, min(8, len(far_files))))
+  try:
+    all_blobs = thread_pool.map(
+        lambda far_file: GetBlobs(far_file, build_out_dir, extract_dir,
+                                  compressed_dir, pool, excluded_files),
+        far_files)
+  finally:
+    thread_pool.close()
+    thread_pool.join()
+    pool.close()
+    pool.join()
+
+  # Count number of packages sharing blobs (a count of 1 is not shared).
+  package_blobs = {}
+  blob_counts = collections.defaultdict(int)
+  for package_name, blobs in zip(package_names, all_blobs):
+    package_blobs[package_name] = blobs
+    for blob_name in blobs:
+      blob_counts[blob_name] += 1
 
   # Print package blob sizes (does not count sharing).
   for package_name in sorted(package_blobs.keys()):
@@ -354,29 +418,22 @@ def GetPackageSizes(far_files, build_out_dir, extract_dir):
     print('%-64s %12s %12s %s' %
           ('blob hash', 'compressed', 'uncompressed', 'path'))
     print('%s %s %s %s' % (64 * '-', 12 * '-', 12 * '-', 20 * '-'))
-    for blob_name in sorted(package_blobs[package_name].keys()):
-      blob_hash = package_blobs[package_name][blob_name].hash
-      compressed = package_blobs[package_name][blob_name].compressed
-      uncompressed = package_blobs[package_name][blob_name].uncompressed
+    blobs = package_blobs[package_name]
+    for blob_name in sorted(blobs.keys()):
+      blob = blobs[blob_name]
       print('%64s %12d %12d %s' %
-            (blob_hash, compressed, uncompressed, blob_name))
-
-  # Count number of packages sharing blobs (a count of 1 is not shared).
-  blob_counts = collections.defaultdict(int)
-  for package_name in package_blobs:
-    for blob_name in package_blobs[package_name]:
-      blob_counts[blob_name] += 1
+            (blob.hash, blob.compressed, blob.uncompressed, blob_name))
 
-  # Package sizes are the sum of blob sizes divided by their share counts.
+  # Package sizes are the sum of blob sizes divided by their share counts,
+  # in whole bytes.
   package_sizes = {}
-  for package_name in package_blobs:
+  for package_name, blobs in package_blobs.items():
     compressed_total = 0
     uncompressed_total = 0
-    for blob_name in package_blobs[package_name]:
+    for blob_name, blob in blobs.items():
       count = blob_counts[blob_name]
-      blob = package_blobs[package_name][blob_name]
-      compressed_total += blob.compressed / count
-      uncompressed_total += blob.uncompressed / count
+      compressed_total += blob.compressed // count
+      uncompressed_total += blob.uncompressed // count
     package_sizes[package_name] = PackageSizes(compressed_total,
                                                uncompressed_total)
 
@@ -36,6 +36,28 @@ class TestBinarySizes(unittest.TestCase):
         'refs/heads/master@{#819458}')
     self.assertEqual(commit_position, 819458)
 
+  def testBlobNameHashes(self):
+    meta_dir = os.path.join(self.tmpdir, 'blob_name_hashes')
+    os.makedirs(os.path.join(meta_dir, 'meta'))
+    with open(os.path.join(meta_dir, 'meta', 'contents'), 'w') as contents:
+      contents.write('bin/app=1234\nlib/libfoo.so=abcd \n\n')
+    self.assertEqual(binary_sizes.GetBlobNameHashes(meta_dir), {
+        'bin/app': '1234',
+        'lib/libfoo.so': 'abcd',
+    })
+
+    with open(os.path.join(meta_dir, 'meta', 'contents'), 'w') as contents:
+      contents.write('bin/app=1234\nlib/libfoo.so\n')
+    self.assertRaises(Exception, binary_sizes.GetBlobNameHashes, meta_dir)
+
+  def testSharedObjectFileName(self):
+    for name in ['libc.so', 'libc.so.6', 'libfoo.so.12']:
+      self.assertTrue(binary_sizes.IsSharedObjectFileName(name), name)
+    for name in [
+        'libfoo.so.1.2', 'libfoo.so.debug', 'libfoo.sox', 'icu.dat', '123'
+    ]:
+      self.assertFalse(binary_sizes.IsSharedObjectFileName(name), name)
+
   def testCompressedSize(self):
     """Verifies that the compressed file size can be extracted from the
     blobfs-compression output."""